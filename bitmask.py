@@ -0,0 +1,14 @@
+def bitmask_iter(mask, length):
+    """ turn mask into list of the bits, least significant bit at index 0 """
+    i = length
+    while i:
+        yield mask & 0x01
+        mask >>= 1
+        i -= 1
+
+def bitmask_pack(bits):
+    """ turn a list of bits (as from bitmask_iter) back into a mask """
+    mask = 0
+    for i, bit in enumerate(bits):
+        mask |= bit << i
+    return mask
@@ -0,0 +1,69 @@
+import bisect
+import math
+
+# stick components can end up a little past 1 near the corners once the
+# vector deadzone is taken out, so sample a bit further than that
+DOMAIN = 1.5
+SAMPLES = 512
+
+class Curve:
+    """ A response curve sampled into a lookup table when the profile is
+            loaded; evaluating it is an interpolated table lookup, however
+            complicated the curve it was built from.
+    """
+    def __init__(self, function, domain=DOMAIN, samples=SAMPLES):
+        self.domain = domain
+        self.scale = (samples - 1) / domain
+        self.last = samples - 1
+        self.table = [function(i * domain / (samples - 1))
+                      for i in range(samples)]
+    def __call__(self, x):
+        """ -> f(|x|) with the sign of x; |x| past the domain is clamped """
+        a = abs(x) * self.scale
+        if a >= self.last:
+            return math.copysign(self.table[self.last], x)
+        i = int(a)
+        lo = self.table[i]
+        return math.copysign(lo + (self.table[i + 1] - lo) * (a - i), x)
+
+def power(exp):
+    return lambda x: x ** exp
+
+def points(pts):
+    """ piecewise linear through pts, [[x, y], ...]; flat past either end """
+    pts = sorted(pts)
+    xs = [p[0] for p in pts]
+    ys = [p[1] for p in pts]
+    def f(x):
+        i = bisect.bisect_right(xs, x)
+        if i == 0:
+            return ys[0]
+        if i == len(xs):
+            return ys[-1]
+        x0, x1, y0, y1 = xs[i - 1], xs[i], ys[i - 1], ys[i]
+        return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return f
+
+def sCurve(exp):
+    """ slow near 0 and near 1, fast through the middle; 1 past x = 1 """
+    def f(x):
+        if x >= 1:
+            return 1
+        return x ** exp / (x ** exp + (1 - x) ** exp)
+    return f
+
+def compileCurve(spec, domain=DOMAIN):
+    """ Build a Curve from its profile description, which is either a number
+            (an exponent, as with the 'exp' key) or a dict with a 'type' of
+            "power" ('exp'), "points" ('points': [[x, y], ...]) or "s" ('exp')
+    """
+    if not isinstance(spec, dict):
+        return Curve(power(spec), domain)
+    type = spec.get('type', 'power')
+    if type == 'power':
+        return Curve(power(spec.get('exp', 1)), domain)
+    elif type == 'points':
+        return Curve(points(spec['points']), domain)
+    elif type == 's':
+        return Curve(sCurve(spec.get('exp', 2)), domain)
+    raise ValueError("Unknown response curve type '" + str(type) + "'")
@@ -0,0 +1,85 @@
+import collections
+import queue
+import sys
+import threading
+import time
+
+# time is in seconds since the log was opened
+Record = collections.namedtuple('Record', ('frame', 'time', 'event',
+                                           'source', 'response', 'message'))
+
+class DebugLog:
+    """ Hands debug records to a background thread that writes them out, so
+            debugging never makes a frame wait on the console.
+            Records are rate limited per (source, response): a 'pressed'
+            record gets through if it is at least interval seconds after the
+            last one that did, and every other event (e.g. 'released')
+            follows the fate of the press before it, so presses and their
+            releases are kept or dropped together. The next record that gets
+            through says how many were dropped in between; the last dropped
+            record of each key is written out on close.
+    """
+    def __init__(self, path=None, interval=0.1):
+        self.path = path
+        self.file = open(path, mode='a') if path else sys.stdout
+        self.interval = interval
+        self.start = time.perf_counter()
+        # (source, response) -> time of the last press that got through
+        self.last = {}
+        # (source, response) -> whether the last press got through
+        self.keep = {}
+        # (source, response) -> (number dropped, last record dropped)
+        self.dropped = {}
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+    def log(self, frame, event, source, response, message=None):
+        now = time.perf_counter() - self.start
+        key = (source, response)
+        if event == 'pressed':
+            last = self.last.get(key, None)
+            self.keep[key] = last is None or now - last >= self.interval
+            if self.keep[key]:
+                self.last[key] = now
+        record = Record(frame, now, event, source, response, message)
+        if not self.keep.get(key, True):
+            count = self.dropped.get(key, (0, None))[0]
+            self.dropped[key] = (count + 1, record)
+            return
+        self.queue.put((record, self.dropped.pop(key, (0, None))[0]))
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            record, dropped = item
+            self.file.write(formatRecord(record, dropped) + '\n')
+            if self.queue.empty():
+                self.file.flush()
+        self.file.flush()
+    def close(self):
+        """ Write out everything still queued, including the last record of
+                anything that was being dropped, and stop the writer
+        """
+        if self.thread is None:
+            return
+        for count, record in sorted(self.dropped.values(),
+                                    key=lambda d: d[1].frame):
+            self.queue.put((record, count - 1))
+        self.dropped = {}
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.path:
+            self.file.close()
+
+def formatRecord(record, dropped=0):
+    out = ('frame ' + str(record.frame) + ' at ' + format(record.time, '.4f')
+           + 's: ' + record.event + ' ' + str(record.response))
+    if record.source is not None:
+        out += ' (' + record.source + ')'
+    if record.message is not None:
+        out += '; message: ' + str(record.message)
+    if dropped:
+        out += '; ' + str(dropped) + ' more since the last one'
+    return out
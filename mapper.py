@@ -7,19 +7,28 @@ import sys
 import xinput
 from xinput import NoControllerError
 import robot
+import shared
+import remote
+import curves
+import debuglog
+import monitor
 
 class XInputController:
-    def __init__(self, name, descriptor):
+    def __init__(self, name, descriptor, source=xinput):
+        """ source is anything with a poll(id) that returns states shaped like
+                xinput.poll(); e.g. a remote.Receiver
+        """
         if descriptor['type'] != "xinput":
             raise NotImplementedError("This is not an XInput controller")
         self.name = name
         self.descriptor = descriptor
+        self.source = source
         self.current = None
         self.previous = None
     def poll(self, id):
         """ Updates the states of the controller """
         # read the state from the computer
-        state = xinput.poll(id)
+        state = self.source.poll(id)
         # update the internal state objects
         if self.previous is None:
             self.previous = state
@@ -38,6 +47,14 @@ class XInputController:
             else:
                 # trigger must be a single trigger, and should be a dict
                 t.append(t)
+    def changed(self):
+        """ -> True if the last poll read a different state than the one
+                before it
+        """
+        if 'packet_number' in self.current:
+            return (self.current['packet_number']
+                    != self.previous['packet_number'])
+        return self.current != self.previous
     def getInput(self, identifier):
         """ identifier -> (type, previous val, current val) """
         type, identifier = self._mapIdentifier(identifier)
@@ -176,20 +193,110 @@ class Profile:
 
         self.id = profile['id']
         self.mappings = profile["mappings"]
-        self.triggers = []
+        self.layerMappings = profile.get("layers", {})
         self.pressed = set()
         self.validTriggerTypes = ("hold", "press", "release", "repeat", "move",
                                   "toggle")
-        self._parseMappings()
+        # every layer is compiled up front; switching layers only swaps which
+        # trigger list step() walks, and inactive layers are never visited
+        self.triggers = self._parseMappings(self.mappings)
+        self.layers = dict((k, self._parseMappings(v, k))
+                           for k, v in self.layerMappings.items())
+        self.layer = profile.get('layer', None)
+        if self.layer is not None and self.layer not in self.layers:
+            raise ValueError("Profile '" + name + "' starts in unknown layer '"
+                             + self.layer + "'")
+        self.layerTriggers = self.layers.get(self.layer, [])
+        self.layerStack = [self.layer]
+        self.layerChanged = False
         self.debug = profile.get('debug', False)
+        # debug messages are written by a background thread, not the frame;
+        # it is only started if something will be logged
+        self.log = None
+        if self.debug or any(t['info'].get('debug', None)
+                             for triggers in [self.triggers]
+                                 + list(self.layers.values())
+                             for t in triggers):
+            self.log = debuglog.DebugLog(profile.get('debug log', None))
+        self.frame = 0
+        self.stepTime = 0
+        # drop to a slow poll rate after this many seconds without input
+        self.idleAfter = profile.get('idle after', None)
+        self.idleDt = profile.get('idle dt', 0.1)
+        # optionally share each frame's state with other local processes
+        publish = profile.get('publish', None)
+        self.publisher = shared.StatePublisher(publish) if publish else None
+        # optionally read the controller from another machine's remote.stream
+        info = profile.get('remote', None)
+        self.receiver = None
+        if info is not None:
+            if 'sender' not in info:
+                raise ValueError("Profile '" + name + "' has a 'remote' "
+                                 + "without the 'sender' to accept it from")
+            self.receiver = remote.Receiver(info['sender'],
+                                            info.get('host', None),
+                                            info.get('port', remote.PORT))
+            self.controller.source = self.receiver
     def step(self, dt):
+        start = time.perf_counter()
+        self.poll()
+        self.dispatch(dt)
+        self.stepTime = time.perf_counter() - start
+    def poll(self):
+        """ Read the controller without running any triggers """
+        self.frame += 1
         self.controller.poll(self.id)
-        for t in self.triggers:
-            try:
-                getattr(self, 'on' + t['triggerType'].capitalize())(t, dt)
-            except AbortException as e:
-                self.releaseAll()
-                raise e
+        if self.publisher is not None:
+            self.publisher.publish(self.controller, self.frame,
+                                   self.stepTime)
+            if self.publisher.statusDue():
+                self.publisher.publishStatus(self.status())
+    def dispatch(self, dt):
+        """ Run the triggers of the active layers against the last poll """
+        try:
+            for t in self.triggers:
+                t['handler'](t, dt)
+            for t in self.layerTriggers:
+                t['handler'](t, dt)
+        except AbortException as e:
+            self.releaseAll()
+            raise e
+        if self.layerChanged:
+            self._switchLayer()
+    def isMoving(self):
+        """ -> True if a move trigger would currently move anything """
+        for triggers in (self.triggers, self.layerTriggers):
+            for t in triggers:
+                if t['triggerType'] != 'move':
+                    continue
+                c = self.controller.getInput(t['triggerSource'])[2]
+                info = t['info']
+                if c[info['x component']] or c[info['y component']]:
+                    return True
+        return False
+    def activeTriggers(self):
+        """ -> descriptions of the triggers whose input is currently active """
+        out = []
+        for triggers in (self.triggers, self.layerTriggers):
+            for t in triggers:
+                type, p, c = self.controller.getInput(t['triggerSource'])
+                info = t['info']
+                if t['triggerType'] == 'move':
+                    active = c[info['x component']] or c[info['y component']]
+                else:
+                    active = self._areInputsActive(info, type, p, c)[1]
+                if active:
+                    out.append(t['triggerSource'] + ': ' + t['response']
+                               + ' on ' + t['triggerType'])
+        return out
+    def status(self):
+        """ -> a summary of the profile for monitors, see shared.py """
+        return {
+            'layer': self.layer,
+            'buttons': list(self.controller.descriptor['buttons']),
+            'pressed': sorted(self.pressed),
+            'active': self.activeTriggers()
+        }
     def onMove(self, trigger, dt):
         if trigger['response'] != 'move mouse':
             raise NotImplementedError('Only move mouse is defined for onMove')
@@ -197,63 +304,93 @@ class Profile:
         if t != 'vector':
             raise TypeError('Only vector types are supported for move mouse')
         info = trigger['info']
-        vec = [c[info['x component']], c[info['y component']]]
-        # raise input values to a power to control sensitivity
-        vec[0] = math.copysign(abs(vec[0])**info.get('exp', 1), vec[0])
-        vec[1] = math.copysign(abs(vec[1])**info.get('exp', 1), vec[1])
+        # put the input values through the response curve (a lookup table
+        # compiled from 'curve' or 'exp' when the profile was loaded)
+        curve = trigger['curve']
+        x = curve(c[info['x component']])
+        y = curve(c[info['y component']])
         # get the length of this vector
-        magnitude = math.sqrt(vec[0]**2 + vec[1]**2)
-        if vec[0] == 0 or vec[1] == 0:
+        magnitude = math.sqrt(x*x + y*y)
+        if x == 0 or y == 0:
             # catch x/0 errors
             scale = 1
         else:
             # given that magnitude*sec = h/cos and csc = h/sin
             # use sec if (cos==x) > (sin==y) else use csc
-            scale = magnitude/max(abs(vec[0]), abs(vec[1]))
+            scale = magnitude/max(abs(x), abs(y))
+        # speed up the longer the stick is held away from the center
+        accel = trigger['accel']
+        if accel is not None:
+            if x or y:
+                trigger['held'] += dt
+                scale *= accel(trigger['held'])
+            else:
+                trigger['held'] = 0
 
-        robot.translateMouse(scale * info['x speed'] * dt * vec[0],
-                             scale * info['y speed'] * dt * vec[1])
+        robot.translateMouse(scale * info['x speed'] * dt * x,
+                             scale * info['y speed'] * dt * y)
     def onToggle(self, trigger, dt):
         t, p, c = self.controller.getInput(trigger['triggerSource'])
         p, c = self._areInputsActive(trigger['info'], t, p, c)
         if not p and c:
-            # user just pressed the input
-            if trigger['response'] not in self.pressed:
-                self.press(trigger['response'], trigger['info'])
+            # user just pressed the input; if another trigger released
+            # the response since this one pressed it, press it again
+            if (not trigger['down']
+                    or trigger['response'] not in self.pressed):
+                self._hold(trigger)
             else:
-                self.release(trigger['response'], trigger['info'])
+                self._letGo(trigger)
     def onHold(self, trigger, dt):
         t, p, c = self.controller.getInput(trigger['triggerSource'])
         p, c = self._areInputsActive(trigger['info'], t, p, c)
         if not p and c:
             # user just pressed the input
-            self.press(trigger['response'], trigger['info'])
+            self._hold(trigger)
         elif p and not c:
             # user just released the input
-            self.release(trigger['response'], trigger['info'])
+            self._letGo(trigger)
     def onPress(self, trigger, dt):
         t, p, c = self.controller.getInput(trigger['triggerSource'])
         p, c = self._areInputsActive(trigger['info'], t, p, c)
         if not p and c:
             # user just pressed the input
-            self.press(trigger['response'], trigger['info'])
-            self.release(trigger['response'], trigger['info'])
+            self.press(trigger['response'], trigger['info'],
+                       trigger['triggerSource'])
+            self.release(trigger['response'], trigger['info'],
+                         trigger['triggerSource'])
     def onRelease(self, trigger, dt):
         t, p, c = self.controller.getInput(trigger['triggerSource'])
         p, c = self._areInputsActive(trigger['info'], t, p, c)
         if p and not c:
             # user just released the input
-            self.press(trigger['response'], trigger['info'])
-            self.release(trigger['response'], trigger['info'])
+            self.press(trigger['response'], trigger['info'],
+                       trigger['triggerSource'])
+            self.release(trigger['response'], trigger['info'],
+                         trigger['triggerSource'])
     def onRepeat(self, trigger, dt):
         raise NotImplementedError("On repeat not yet implemented")
-    def press(self, response, info=None):
+    def _hold(self, trigger):
+        """ Press trigger's response, and remember that trigger holds it """
+        trigger['down'] = True
+        self.press(trigger['response'], trigger['info'],
+                   trigger['triggerSource'])
+    def _letGo(self, trigger):
+        """ Release trigger's response, if trigger is the one holding it.
+                (e.g. a hold whose input was already down when its layer
+                became active never pressed anything)
+        """
+        if trigger['down']:
+            trigger['down'] = False
+            self.release(trigger['response'], trigger['info'],
+                         trigger['triggerSource'])
+    def press(self, response, info=None, source=None):
         info = info or {}
         # record that this trigger was responded to
         self.pressed.add(response)
         # check if we need to display a debug message
         if self.debug or info.get('debug', None):
-            print('pressed', response, '; message:', info.get('debug', None))
+            self.log.log(self.frame, 'pressed', source, response,
+                         info.get('debug', None))
         # handle the response
         if response == "left click":
             robot.mouseButton(robot.MOUSEEVENTF_LEFTDOWN)
@@ -267,16 +404,20 @@ class Profile:
             robot.scrollWheel(x=info['amount'])
         elif response in robot.keys.keys():
             robot.pressKey(robot.keys[response])
+        elif response.startswith("layer "):
+            self.layerStack.append(response[6:])
+            self.layerChanged = True
         elif response == "abort":
             raise AbortException("Abort key pressed")
         else:
             # assume its a keyboard key
             robot.pressKey(robot.getKeyFromAscii(response))
-    def release(self, response, info=None):
+    def release(self, response, info=None, source=None):
         info = info or {}
         self.pressed.discard(response)
         if self.debug or info.get('debug', None):
-            print('\treleased', response, '; message:', info.get('debug', None))
+            self.log.log(self.frame, 'released', source, response,
+                         info.get('debug', None))
         if response == "left click":
             robot.mouseButton(robot.MOUSEEVENTF_LEFTUP)
         elif response == "right click":
@@ -287,6 +428,8 @@ class Profile:
             pass
         elif response == "scroll x":
             pass
+        elif response.startswith("layer "):
+            self._popLayer(response[6:])
         elif response == "abort":
             pass
         elif response in robot.keys.keys():
@@ -313,16 +456,21 @@ class Profile:
             vec = c
             c = True if th[1] <= vec[comp] and vec[comp] <= th[2] else False
             return p, c
-    def _parseMappings(self):
-        for inputSrc, triggerDescriptor in self.mappings.items():
+    def _parseMappings(self, mappings, layer=None):
+        """ Compile a mappings dict into a list of triggers (a dispatch table)
+                layer: the name of the layer the mappings belong to, if any
+        """
+        triggers = []
+        for inputSrc, triggerDescriptor in mappings.items():
             if type(triggerDescriptor) is list:
                 for i in triggerDescriptor:
-                    res = self._parseMapping(inputSrc, i)
-                    self.triggers.append(res)
+                    res = self._parseMapping(inputSrc, i, layer)
+                    triggers.append(res)
             else:
-                res = self._parseMapping(inputSrc, triggerDescriptor)
-                self.triggers.append(res)
-    def _parseMapping(self, src, descriptor):
+                res = self._parseMapping(inputSrc, triggerDescriptor, layer)
+                triggers.append(res)
+        return triggers
+    def _parseMapping(self, src, descriptor, layer=None):
         if type(descriptor) is str:
             action = descriptor
             descriptor = {"action": action}
@@ -337,21 +485,94 @@ class Profile:
         if triggerType not in self.validTriggerTypes:
             raise NotImplementedError("'on" + triggerType
                                     + "' trigger has not been implemented.")
-                                    
-        # return a single trigger
-        return {
+        if (response.startswith("layer ")
+                and response[6:] not in self.layerMappings):
+            raise ValueError("Profile mapping '" + src
+                           + "' switches to unknown layer '" + response[6:]
+                           + "'")
+        if response.startswith("layer ") and layer is not None:
+            # a layer stops being dispatched once it is switched away from,
+            # so it would never see the input that should switch back
+            raise ValueError("Mapping '" + src + "' in layer '" + layer
+                           + "' switches layers; layer switches belong in "
+                           + "the profile's mappings")
+        if response.startswith("layer ") and triggerType in ("press",
+                                                             "release"):
+            # the layer would be pushed and popped in the same step
+            raise ValueError("Mapping '" + src + "' switches layers on "
+                           + triggerType + "; use on toggle or on hold")
+
+        trigger = {
             "triggerType": triggerType,
             "response": response,
             "triggerSource": src.strip(),
-            "info": descriptor
+            "info": descriptor,
+            # resolve the handler once so step() doesn't have to look it up
+            "handler": getattr(self, 'on' + triggerType.capitalize()),
+            # whether this trigger is holding its response down
+            "down": False
         }
+        if triggerType == "move":
+            # 'exp' is shorthand for a power curve
+            trigger["curve"] = curves.compileCurve(
+                descriptor.get('curve', descriptor.get('exp', 1)))
+            accel = descriptor.get('accel', None)
+            trigger["accel"] = None
+            if accel is not None:
+                # the acceleration curve maps seconds held -> speed multiplier
+                seconds = accel.get('time', 1) if type(accel) is dict else 1
+                trigger["accel"] = curves.compileCurve(accel, seconds)
+            trigger["held"] = 0
+        # return a single trigger
+        return trigger
     def _parseAction(self, action):
         response, triggerType = action.split(" on ")
         return triggerType.strip(), response.strip()
+    def _popLayer(self, layer):
+        """ Remove the most recent activation of layer from the layer stack;
+                the layer the profile started in is never removed.
+        """
+        for i in range(len(self.layerStack) - 1, 0, -1):
+            if self.layerStack[i] == layer:
+                del self.layerStack[i]
+                self.layerChanged = True
+                return
+    def _switchLayer(self):
+        """ Make the layer on top of the layer stack the active one.
+                Called at the end of a step so a switch never happens halfway
+                through a dispatch table. Anything still held by the outgoing
+                layer's own triggers is released, since they will not run
+                again to release it; what other triggers hold is left alone.
+        """
+        self.layerChanged = False
+        layer = self.layerStack[-1]
+        if layer == self.layer:
+            return
+        previous = self.layerTriggers
+        self.layer = layer
+        self.layerTriggers = self.layers.get(layer, [])
+        for t in previous:
+            self._letGo(t)
     def releaseAll(self):
+        for triggers in [self.triggers] + list(self.layers.values()):
+            for t in triggers:
+                t['down'] = False
         for k in set(self.pressed):
             self.release(k)
         print('All keys released.')
+    def close(self):
+        """ Free anything the profile shares with other processes/machines,
+                and finish writing the debug log
+        """
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        if self.receiver is not None:
+            self.controller.source = xinput
+            self.receiver.close()
+            self.receiver = None
+        if self.log is not None:
+            self.log.close()
 
 def readControllers():
     # combine all the controller settings defined in ./settings
@@ -386,10 +607,15 @@ def readProfiles():
 def loop(profile):
     dt = 0.014
     print('Running with', dt, 'delta time.')
+    if profile.idleAfter is not None:
+        print('Idling at', profile.idleDt, 'delta time after',
+              profile.idleAfter, 'seconds without input.')
     previous = time.time()
     elapsed = 0
     frames = 0
     all = 0
+    # how long the controller has gone without changing
+    still = 0
     try:
         while True:
             current = time.time()
@@ -401,6 +627,18 @@ def loop(profile):
                 profile.step(dt)
                 elapsed -= dt
                 frames += 1
+                still = 0 if profile.controller.changed() else still + dt
+                if (profile.idleAfter is not None
+                        and still >= profile.idleAfter
+                        and not profile.isMoving()):
+                    idle(profile, dt)
+                    frames += 1
+                    still = 0
+                    # don't try to catch up on the frames skipped while idle
+                    current = time.time()
+                    all += current - previous
+                    previous = current
+                    elapsed = 0
     except AbortException:
         pass
     except KeyboardInterrupt:
@@ -409,16 +647,41 @@ def loop(profile):
     print('keys pressed:', list(profile.pressed))
     print('Quitting, did', frames, 'frames in', all,
           'seconds, fps:', frames/all)
+    profile.close()
+
+def idle(profile, dt):
+    """ Poll every profile.idleDt seconds until the controller changes, then
+            run the triggers for that poll so the input that woke us is not
+            lost. Triggers (including move triggers) do not run while idle;
+            loop() only idles when no move trigger is moving anything.
+    """
+    while True:
+        time.sleep(profile.idleDt)
+        profile.poll()
+        if profile.controller.changed():
+            profile.dispatch(dt)
+            return
 
 def stick_test(p, c, freq):
+    """ Show the normalized sticks of controller 0. To watch a running mapper
+            instead, use monitor.py.
+    """
     x = c['xbox360']
-    import os
-    while True:
-        x.poll(0)
-        print(x.getInput("left stick")[1], 8)
-        print(x.getInput("right stick")[1], 8)
-        time.sleep(freq)
-        os.system('CLS')
+    screen = monitor.Screen()
+    try:
+        while True:
+            x.poll(0)
+            screen.draw([
+                "Hit Ctrl-C to exit.",
+                "Left stick:  "
+                    + monitor.formatVector(x.getInput("left stick")[2]),
+                "Right stick: "
+                    + monitor.formatVector(x.getInput("right stick")[2])
+            ])
+            time.sleep(freq)
+    except KeyboardInterrupt:
+        pass
+    screen.close()
     
 if __name__ == "__main__":
     c = readControllers()
@@ -0,0 +1,141 @@
+import ctypes
+import os
+import sys
+import time
+
+import shared
+
+ESC = '\x1b['
+
+def enableAnsi():
+    """ Turn on ANSI escape handling in the Windows console (Windows 10+);
+            other terminals already understand them
+    """
+    if os.name != 'nt':
+        return
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+    mode = ctypes.c_ulong()
+    if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        kernel32.SetConsoleMode(handle, mode.value | 0x0004)
+
+class Screen:
+    """ Draws a block of lines in place in the terminal.
+            Each draw only writes the cells that changed since the last one,
+            using ANSI cursor movement, instead of clearing the screen.
+    """
+    def __init__(self, file=sys.stdout):
+        self.file = file
+        self.lines = []
+        enableAnsi()
+        # clear the screen and hide the cursor
+        self.file.write(ESC + '2J' + ESC + '?25l')
+        self.file.flush()
+    def draw(self, lines):
+        out = []
+        for row, line in enumerate(lines):
+            old = self.lines[row] if row < len(self.lines) else ''
+            if line == old:
+                continue
+            start = 0
+            while (start < len(line) and start < len(old)
+                   and line[start] == old[start]):
+                start += 1
+            move = ESC + str(row + 1) + ';' + str(start + 1) + 'H'
+            if len(line) == len(old):
+                end = len(line)
+                while line[end - 1] == old[end - 1]:
+                    end -= 1
+                out.append(move + line[start:end])
+            else:
+                # erase whatever is left of the old line
+                out.append(move + line[start:] + ESC + 'K')
+        for row in range(len(lines), len(self.lines)):
+            out.append(ESC + str(row + 1) + ';1H' + ESC + 'K')
+        self.lines = list(lines)
+        if out:
+            self.file.write(''.join(out))
+            self.file.flush()
+    def close(self):
+        # put the cursor back, below what was drawn
+        self.file.write(ESC + str(len(self.lines) + 1) + ';1H' + ESC + '?25h')
+        self.file.flush()
+
+def formatAxis(v):
+    return format(v, '+.3f')
+
+def formatVector(vec):
+    return 'x ' + formatAxis(vec['x']) + '  y ' + formatAxis(vec['y'])
+
+def render(name, state, fps):
+    """ -> the monitor's lines for a state from shared.StateReader.read() """
+    if state is None:
+        return ['Waiting for the mapper to publish "' + name + '"...']
+    raw = state['raw']
+    normalized = state['normalized']
+    status = state['status'] or {}
+    buttons = status.get('buttons', [str(i) for i in range(16)])
+    pressed = [buttons[i] or str(i) for i, b in enumerate(raw['buttons']) if b]
+    active = status.get('active', []) or ['']
+    return [
+        'Monitoring "' + name + '" (Ctrl-C to exit)',
+        'Frame ' + str(state['frame']).rjust(10)
+            + '   step ' + format(state['step time'] * 1000, '7.3f') + ' ms'
+            + '   ' + format(fps, '7.1f') + ' fps',
+        '',
+        'Packet ' + str(raw['packet_number']).rjust(10),
+        'Buttons: ' + ' '.join(pressed),
+        'Raw:   LT ' + str(raw['left_trigger']).rjust(3)
+            + '  RT ' + str(raw['right_trigger']).rjust(3)
+            + '  L ' + str(raw['l_thumb_x']).rjust(6)
+            + ' ' + str(raw['l_thumb_y']).rjust(6)
+            + '  R ' + str(raw['r_thumb_x']).rjust(6)
+            + ' ' + str(raw['r_thumb_y']).rjust(6),
+        'Axes:  LT ' + formatAxis(normalized['left_trigger'])
+            + '  RT ' + formatAxis(normalized['right_trigger'])
+            + '  L ' + formatAxis(normalized['l_thumb_x'])
+            + ' ' + formatAxis(normalized['l_thumb_y'])
+            + '  R ' + formatAxis(normalized['r_thumb_x'])
+            + ' ' + formatAxis(normalized['r_thumb_y']),
+        'Left stick:  ' + formatVector(normalized['left stick']),
+        'Right stick: ' + formatVector(normalized['right stick']),
+        '',
+        'Layer:   ' + str(status.get('layer', None)),
+        'Pressed: ' + ', '.join(status.get('pressed', [])),
+        'Active:  ' + active[0]
+    ] + ['         ' + t for t in active[1:]]
+
+def monitor(name='controllerbuddy', rate=20):
+    """ Attach to a mapper publishing as name (see the profile's 'publish'
+            key) and show its state, redrawing at most rate times a second.
+            Reading never blocks or slows down the mapper.
+    """
+    while True:
+        try:
+            reader = shared.StateReader(name)
+            break
+        except FileNotFoundError:
+            print('Waiting for the mapper to publish "' + name + '"...')
+            time.sleep(1)
+    screen = Screen()
+    previous = None
+    fps = 0
+    try:
+        while True:
+            state = reader.read()
+            if state is not None and previous is not None:
+                frames = state['frame'] - previous['frame']
+                seconds = state['time'] - previous['time']
+                if frames and seconds > 0:
+                    fps = frames / seconds
+            previous = state
+            screen.draw(render(name, state, fps))
+            time.sleep(1 / rate)
+    except KeyboardInterrupt:
+        pass
+    screen.close()
+    reader.close()
+
+if __name__ == "__main__":
+    monitor(*sys.argv[1:2])
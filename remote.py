@@ -0,0 +1,269 @@
+import socket
+import struct
+import sys
+import time
+
+from bitmask import bitmask_iter, bitmask_pack
+
+PORT = 28800
+
+# a packet is a header followed by the fields that changed since the last
+# packet, in FIELDS order. The header is
+#   sequence:   uint16, wraps around
+#   mask:       uint8, bit i set if FIELDS[i] is in the packet; KEYFRAME is set
+#               on packets that carry every field
+# so a packet is between 3 and 17 bytes, and decoding it is a single unpack.
+FIELDS = ('buttons', 'left_trigger', 'right_trigger',
+          'l_thumb_x', 'l_thumb_y', 'r_thumb_x', 'r_thumb_y')
+FORMATS = ('H', 'B', 'B', 'h', 'h', 'h', 'h')
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+KEYFRAME = 0x80
+HEADER = struct.Struct('<HB')
+# one precompiled packet struct (and the field indices it carries) per mask
+PACKETS = [struct.Struct('<HB' + ''.join(f for i, f in enumerate(FORMATS)
+                                         if mask & (1 << i)))
+           for mask in range(ALL_FIELDS + 1)]
+INDICES = [tuple(i for i in range(len(FIELDS)) if mask & (1 << i))
+           for mask in range(ALL_FIELDS + 1)]
+PACKET_SIZE = PACKETS[ALL_FIELDS].size
+# receive whole datagrams, whatever their size; on Windows recvfrom raises
+# instead of truncating one that does not fit, so a stray large datagram
+# would otherwise stop the receiver
+RECEIVE_SIZE = 65536
+# a keyframe further behind than this is from a restarted sender, not one
+# that arrived late
+REORDER_WINDOW = 256
+
+# send a keyframe every this many polls, even if nothing changed, so that a
+# receiver recovers from lost packets (and learns the state when it starts)
+KEYFRAME_INTERVAL = 100
+
+def stateValues(state):
+    """ xinput.poll() state -> tuple of field values for an Encoder """
+    return (bitmask_pack(state['buttons']),
+            state['left_trigger'], state['right_trigger'],
+            state['l_thumb_x'], state['l_thumb_y'],
+            state['r_thumb_x'], state['r_thumb_y'])
+
+class Encoder:
+    """ Turns a stream of gamepad states into delta packets """
+    def __init__(self, keyframeInterval=KEYFRAME_INTERVAL):
+        self.keyframeInterval = keyframeInterval
+        self.sequence = 0
+        self.values = None
+        self.packetNumber = None
+        # make sure the first packet is a keyframe
+        self.sinceKeyframe = keyframeInterval
+    def encode(self, state):
+        """ state: as returned by xinput.poll()
+            -> the packet to send, or None if there is nothing to send
+        """
+        self.sinceKeyframe += 1
+        packetNumber = state.get('packet_number', None)
+        if self.sinceKeyframe >= self.keyframeInterval:
+            self.sinceKeyframe = 0
+            mask = ALL_FIELDS
+            values = changed = stateValues(state)
+        elif packetNumber is not None and packetNumber == self.packetNumber:
+            # the packet number only moves when the state does
+            return None
+        else:
+            values = stateValues(state)
+            mask = 0
+            changed = []
+            for i in range(len(FIELDS)):
+                if values[i] != self.values[i]:
+                    mask |= 1 << i
+                    changed.append(values[i])
+            if not mask:
+                self.packetNumber = packetNumber
+                return None
+        self.values = values
+        self.packetNumber = packetNumber
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        flags = mask | KEYFRAME if mask == ALL_FIELDS else mask
+        return PACKETS[mask].pack(self.sequence, flags, *changed)
+
+class Decoder:
+    """ Rebuilds the gamepad state from packets made by an Encoder """
+    def __init__(self):
+        self.sequence = None
+        # the last keyframe turned away as stale, see decode()
+        self.staleKeyframe = None
+        self.values = [0] * len(FIELDS)
+        # counts changes, standing in for the XInput packet number
+        self.packetNumber = 0
+    def decode(self, packet):
+        """ Apply a packet to the state -> True if the state changed.
+                Packets that are not well formed are dropped.
+        """
+        if len(packet) < HEADER.size:
+            return False
+        sequence, flags = HEADER.unpack_from(packet)
+        mask = flags & ALL_FIELDS
+        if (len(packet) != PACKETS[mask].size
+                or (flags & KEYFRAME and mask != ALL_FIELDS)):
+            return False
+        if (self.sequence is not None
+                and not 0 < (sequence - self.sequence) & 0xFFFF < 0x8000
+                and not self._restarted(sequence, flags)):
+            # an old or duplicated packet; anything it carried is stale
+            return False
+        self.sequence = sequence
+        self.staleKeyframe = None
+        fields = PACKETS[mask].unpack_from(packet)
+        changed = False
+        for i, v in zip(INDICES[mask], fields[2:]):
+            if self.values[i] != v:
+                self.values[i] = v
+                changed = True
+        if changed:
+            self.packetNumber = (self.packetNumber + 1) & 0xFFFFFFFF
+        return changed
+    def _restarted(self, sequence, flags):
+        """ -> True if a packet from behind the last sequence is a keyframe
+                from a restarted sender: it is too far behind to be late, or
+                it follows another stale keyframe (a late keyframe is never
+                followed by a newer late one)
+        """
+        if not flags & KEYFRAME:
+            return False
+        if (self.sequence - sequence) & 0xFFFF > REORDER_WINDOW:
+            return True
+        if (self.staleKeyframe is not None
+                and 0 < (sequence - self.staleKeyframe) & 0xFFFF < 0x8000):
+            return True
+        self.staleKeyframe = sequence
+        return False
+    def state(self):
+        """ -> the state in the same form as xinput.poll() """
+        r = dict(zip(FIELDS, self.values))
+        r['buttons'] = list(bitmask_iter(r['buttons'], 16))
+        r['packet_number'] = self.packetNumber
+        return r
+
+class Sender:
+    def __init__(self, address, keyframeInterval=KEYFRAME_INTERVAL):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.encoder = Encoder(keyframeInterval)
+    def send(self, state):
+        """ Send a state as returned by xinput.poll(), if it needs sending """
+        packet = self.encoder.encode(state)
+        if packet is not None:
+            self.socket.sendto(packet, self.address)
+    def close(self):
+        self.socket.close()
+
+def localAddress(remote):
+    """ -> the address of the local interface that traffic to remote uses """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # connecting a UDP socket sends nothing; it only picks a route
+        s.connect((remote, PORT))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+class Receiver:
+    """ A controller source fed by a Sender on another machine.
+            Use it as the source of an XInputController in place of the
+            xinput module; poll() never blocks.
+            Only packets from sender (a host name or address) are accepted,
+            since whoever sends them controls this machine's keyboard and
+            mouse. host is the address to listen on; by default the one of
+            the interface facing sender.
+    """
+    def __init__(self, sender, host=None, port=PORT):
+        self.sender = socket.gethostbyname(sender)
+        if host is None:
+            host = localAddress(self.sender)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+        self.decoder = Decoder()
+        self.current = self.decoder.state()
+    def poll(self, id):
+        """ -> the latest state received (id is ignored) """
+        changed = False
+        while True:
+            try:
+                packet, address = self.socket.recvfrom(RECEIVE_SIZE)
+            except BlockingIOError:
+                break
+            except ConnectionResetError:
+                # Windows reports ICMP errors for earlier datagrams this way
+                continue
+            if address[0] != self.sender:
+                continue
+            changed = self.decoder.decode(packet) or changed
+        if changed:
+            self.current = self.decoder.state()
+        return self.current
+    def close(self):
+        self.socket.close()
+
+def stream(host, port=PORT, id=0, rate=1000,
+           keyframeInterval=KEYFRAME_INTERVAL):
+    """ Poll controller id and stream it to a Receiver at (host, port) """
+    # only the streaming side needs a local controller (and Windows)
+    import xinput
+    sender = Sender((host, port), keyframeInterval)
+    dt = 1 / rate
+    print('Streaming controller', id, 'to', host + ':' + str(port),
+          'at', rate, 'Hz.')
+    nextPoll = time.perf_counter()
+    try:
+        while True:
+            sender.send(xinput.poll(id))
+            nextPoll += dt
+            delay = nextPoll - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind; don't try to catch up with a burst of polls
+                nextPoll = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    sender.close()
+
+def loopbackTest():
+    receiver = Receiver('127.0.0.1', '127.0.0.1', 0)
+    sender = Sender(receiver.address, keyframeInterval=10)
+    # stray datagrams must be dropped, not break the receiver
+    for junk in (b'x', b'\x01\x00\x01', b'\x01\x00\xff\x00', b'\x00' * 40,
+                 b'\x00' * 2000):
+        sender.socket.sendto(junk, receiver.address)
+    state = {'buttons': [0] * 16, 'left_trigger': 0, 'right_trigger': 0,
+             'l_thumb_x': 0, 'l_thumb_y': 0, 'r_thumb_x': 0, 'r_thumb_y': 0,
+             'packet_number': 0}
+    sent = 0
+    for i in range(1000):
+        state = dict(state, buttons=list(state['buttons']))
+        if i % 7 == 0:
+            state['buttons'][i % 16] ^= 1
+        if i % 3 == 0:
+            state['r_thumb_x'] = (i * 97) % 65536 - 32768
+        state['left_trigger'] = (i // 50) % 256
+        state['packet_number'] += 1
+        before = sender.encoder.sequence
+        sender.send(state)
+        if sender.encoder.sequence != before:
+            sent += 1
+        # give the datagram a moment to arrive
+        time.sleep(0.0005)
+        received = receiver.poll(0)
+        for k in FIELDS:
+            if received[k] != state[k]:
+                raise AssertionError("Field '" + k + "' differs after "
+                                     + str(i) + " polls")
+    print('Loopback OK:', sent, 'packets for 1000 polls.')
+    sender.close()
+    receiver.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        stream(sys.argv[1])
+    else:
+        loopbackTest()
@@ -0,0 +1,197 @@
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+
+from bitmask import bitmask_iter, bitmask_pack
+
+# the segment starts with a sequence number, followed by a single state record
+#   sequence:   uint32, odd while the publisher is writing
+#   state:      layout version, frame, timestamp, how long the last step took,
+#               the raw XINPUT_GAMEPAD fields (plus packet number) and the
+#               normalized axes/vectors
+#   status:     uint16 length and up to STATUS_SIZE bytes of JSON describing
+#               the profile (layer, pressed responses, active triggers); it
+#               changes rarely and is only rewritten when it does
+LAYOUT_VERSION = 2
+RAW_FIELDS = ('packet_number', 'buttons', 'left_trigger', 'right_trigger',
+              'l_thumb_x', 'l_thumb_y', 'r_thumb_x', 'r_thumb_y')
+AXES = ('left_trigger', 'right_trigger',
+        'l_thumb_x', 'l_thumb_y', 'r_thumb_x', 'r_thumb_y')
+VECTORS = ('left stick', 'right stick')
+COMPONENTS = ('x', 'y')
+
+SEQUENCE = struct.Struct('<I')
+STATE = struct.Struct('<IQdd' + 'IHBBhhhh' + 'd' * len(AXES)
+                      + 'd' * len(VECTORS) * len(COMPONENTS))
+STATUS = struct.Struct('<H')
+STATUS_OFFSET = SEQUENCE.size + STATE.size
+STATUS_SIZE = 2048
+# the status lists that may be shortened to make it fit
+TRIMMED = ('active', 'pressed')
+SIZE = STATUS_OFFSET + STATUS.size + STATUS_SIZE
+# how often (in seconds) the publisher will rebuild the status
+STATUS_INTERVAL = 0.05
+
+class StatePublisher:
+    """ Publishes the latest state of a controller in a named shared memory
+            segment, for other local processes to read with a StateReader.
+            Writes are guarded by a seqlock: the sequence number is odd while
+            a write is in progress, so readers never need to take a lock.
+    """
+    def __init__(self, name):
+        self.name = name
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True,
+                                                     size=SIZE)
+        except FileExistsError:
+            # on Windows a segment only exists while something holds it open,
+            # so this is almost certainly another mapper publishing; two
+            # writers would break the seqlock for each other
+            raise ValueError("Shared state '" + name + "' already exists; "
+                             + "is another mapper publishing under that "
+                             + "name?")
+        self.buffer = self.memory.buf
+        self.sequence = 0
+        self.status = None
+        self.nextStatus = 0
+        SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+        STATUS.pack_into(self.buffer, STATUS_OFFSET, 0)
+    def publish(self, controller, frame, stepTime=0):
+        """ Write the current state of an (already polled) XInputController
+                frame: the number of the frame it was polled in
+                stepTime: how long the last frame took, in seconds
+        """
+        state = controller.current
+        descriptor = controller.descriptor
+        values = [LAYOUT_VERSION, frame, time.time(), stepTime,
+                  state.get('packet_number', 0),
+                  bitmask_pack(state['buttons'])]
+        values.extend(state[k] for k in RAW_FIELDS[2:])
+        for axis in AXES:
+            if axis in descriptor:
+                values.append(controller.normalize(state, 'axis', axis))
+            else:
+                values.append(0)
+        for vector in VECTORS:
+            if vector in descriptor['vector']:
+                vec = controller.getVector(state, 'vector', vector)
+                values.extend(vec.get(c, 0) for c in COMPONENTS)
+            else:
+                values.extend(0 for c in COMPONENTS)
+
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+        STATE.pack_into(self.buffer, SEQUENCE.size, *values)
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+    def statusDue(self):
+        """ -> True if it is time to publish the status again """
+        return time.perf_counter() >= self.nextStatus
+    def publishStatus(self, status):
+        """ Write a JSON-able dict describing the profile, if it changed.
+                The TRIMMED lists are shortened (in a copy) until it fits in
+                STATUS_SIZE; if it still does not fit, the status is cleared.
+        """
+        self.nextStatus = time.perf_counter() + STATUS_INTERVAL
+        data = json.dumps(status, separators=(',', ':')).encode('utf-8')
+        if len(data) > STATUS_SIZE:
+            status = dict(status)
+            for k in TRIMMED:
+                if k in status:
+                    status[k] = list(status[k])
+            while len(data) > STATUS_SIZE:
+                lists = [status[k] for k in TRIMMED if status.get(k, None)]
+                if not lists:
+                    data = b''
+                    break
+                del max(lists, key=len)[-1]
+                data = json.dumps(status, separators=(',', ':')).encode('utf-8')
+        if data == self.status:
+            return
+        self.status = data
+
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+        STATUS.pack_into(self.buffer, STATUS_OFFSET, len(data))
+        start = STATUS_OFFSET + STATUS.size
+        self.buffer[start:start + len(data)] = data
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.buffer, 0, self.sequence)
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+
+class StateReader:
+    """ Reads the state written by a StatePublisher in another process """
+    def __init__(self, name):
+        self.name = name
+        self.memory = shared_memory.SharedMemory(name)
+        self.buffer = self.memory.buf
+        self.statusData = None
+        self.status = None
+    def read(self, retries=1000):
+        """ -> the latest published state, or None if nothing has been
+                published yet (or the publisher never finished a write).
+                The 'raw' dict has the same form as xinput.poll().
+        """
+        for i in range(retries):
+            before = SEQUENCE.unpack_from(self.buffer, 0)[0]
+            if before & 1:
+                # the publisher is halfway through a write
+                continue
+            values = STATE.unpack_from(self.buffer, SEQUENCE.size)
+            length = STATUS.unpack_from(self.buffer, STATUS_OFFSET)[0]
+            start = STATUS_OFFSET + STATUS.size
+            statusData = bytes(self.buffer[start:start + length])
+            if SEQUENCE.unpack_from(self.buffer, 0)[0] == before:
+                break
+        else:
+            return None
+        if before == 0:
+            return None
+        if values[0] != LAYOUT_VERSION:
+            raise ValueError("Shared state '" + self.name + "' has layout "
+                             + str(values[0]) + ", expected "
+                             + str(LAYOUT_VERSION))
+
+        raw = dict(zip(RAW_FIELDS, values[4:4 + len(RAW_FIELDS)]))
+        raw['buttons'] = list(bitmask_iter(raw['buttons'], 16))
+        i = 4 + len(RAW_FIELDS)
+        normalized = dict(zip(AXES, values[i:i + len(AXES)]))
+        i += len(AXES)
+        for vector in VECTORS:
+            normalized[vector] = dict(zip(COMPONENTS,
+                                          values[i:i + len(COMPONENTS)]))
+            i += len(COMPONENTS)
+        # only parse the status when it changes
+        if statusData != self.statusData:
+            self.statusData = statusData
+            self.status = json.loads(statusData.decode('utf-8')) \
+                          if statusData else None
+        return {
+            'sequence': before,
+            'frame': values[1],
+            'time': values[2],
+            'step time': values[3],
+            'raw': raw,
+            'normalized': normalized,
+            'status': self.status
+        }
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+
+def readerTest(name='controllerbuddy'):
+    reader = StateReader(name)
+    try:
+        while True:
+            print(reader.read())
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+
+if __name__ == "__main__":
+    readerTest()
@@ -0,0 +1,249 @@
+import argparse
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import mapper
+import robot
+
+# only allocations made by the mapper's own modules are tracked
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+class ScriptedSource:
+    """ Stand-in for the xinput module: replays a cycle of prebuilt states,
+            so polling it allocates nothing
+    """
+    def __init__(self, states):
+        self.states = states
+        self.i = 0
+    def poll(self, id):
+        state = self.states[self.i]
+        self.i = (self.i + 1) % len(self.states)
+        return state
+
+class NullUser32:
+    """ Stand-in for robot's user32 that counts SendInput calls instead of
+            making them; everything else goes to the real user32. Keeps
+            robot's own code (and its INPUT structs) on the measured path.
+    """
+    def __init__(self, user32):
+        self.user32 = user32
+        self.sent = 0
+    def SendInput(self, count, inputs, size):
+        self.sent += count
+        return count
+    def __getattr__(self, name):
+        return getattr(self.user32, name)
+
+def scriptStates(exclude=(), length=600):
+    """ A cycle of states that sweeps the sticks and triggers around and
+            presses each button in turn, except the indices in exclude
+    """
+    buttons = [i for i in range(16) if i not in exclude]
+    states = []
+    for i in range(length):
+        phase = 2 * math.pi * i / length
+        bits = [0] * 16
+        if (i // 10) % 2:
+            bits[buttons[(i // 20) % len(buttons)]] = 1
+        states.append({
+            'packet_number': i + 1,
+            'buttons': bits,
+            'left_trigger': int(127.5 + 127.5 * math.sin(phase)),
+            'right_trigger': int(127.5 + 127.5 * math.cos(phase)),
+            'l_thumb_x': int(32767 * math.cos(phase)),
+            'l_thumb_y': int(32767 * math.sin(phase)),
+            'r_thumb_x': int(32767 * math.sin(2 * phase)),
+            'r_thumb_y': int(32767 * math.cos(3 * phase))
+        })
+    return states
+
+def abortButtons(profile):
+    """ -> indices of the buttons that would abort the mapper """
+    buttons = profile.controller.descriptor['buttons']
+    out = set()
+    for triggers in [profile.triggers] + list(profile.layers.values()):
+        for t in triggers:
+            if t['response'] == 'abort' and t['triggerSource'] in buttons:
+                out.add(buttons.index(t['triggerSource']))
+    return out
+
+def growthPerFrame(samples):
+    """ least squares slope of [(frame, bytes), ...] -> bytes per frame """
+    n = len(samples)
+    if n < 2:
+        return 0
+    mx = sum(f for f, b in samples) / n
+    my = sum(b for f, b in samples) / n
+    var = sum((f - mx) ** 2 for f, b in samples)
+    return sum((f - mx) * (b - my) for f, b in samples) / var
+
+class PeakCatcher:
+    """ A profile hook that snapshots traced memory whenever it reaches a
+            new high during a step, so the snapshot holds the objects alive
+            at the step's peak (including ones freed before it returns)
+    """
+    def __init__(self, filters):
+        self.filters = filters
+        self.peak = tracemalloc.get_traced_memory()[0]
+        self.snapshot = None
+        # memory taken by the snapshot itself, which is not the mapper's
+        self.overhead = 0
+    def __call__(self, frame, event, arg):
+        if event not in ('return', 'c_return'):
+            return
+        current = tracemalloc.get_traced_memory()[0] - self.overhead
+        if current > self.peak:
+            self.peak = current
+            self.snapshot = None
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                self.filters)
+            self.overhead = tracemalloc.get_traced_memory()[0] - current
+
+def peakSites(profile, filters, frames, dt, top):
+    """ Step profile for frames frames, catching each one at its peak
+        -> (bytes, sites) the mapper's modules held at the peak of the
+            frame where that was the most, compared to where it started
+    """
+    worst = (0, [])
+    for i in range(frames):
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        catcher = PeakCatcher(filters)
+        sys.setprofile(catcher)
+        try:
+            profile.step(dt)
+        finally:
+            sys.setprofile(None)
+        if catcher.snapshot is None:
+            continue
+        stats = catcher.snapshot.compare_to(before, 'lineno')
+        held = sum(stat.size_diff for stat in stats)
+        if held > worst[0]:
+            worst = (held, stats[:top])
+    return worst
+
+def soak(profile, frames, interval, dt=0.014, warmup=10000, top=10,
+         breakdown=200):
+    """ Step profile for frames frames under tracemalloc.
+            Every frame records its peak: how far traced memory rose above
+            where the frame started. This is a high-water mark, not a count
+            or total of allocations; objects freed before the next one is
+            made share the same bytes. Every interval frames a snapshot of
+            the memory held by the mapper's modules is taken, and the last
+            one is compared to the first one to find the sites that grew.
+            Those only show what is kept; what a frame makes and frees again
+            is found by catching breakdown more frames at their peak (which
+            is slow) and listing the sites holding memory then.
+        -> report dict
+    """
+    if frames < 1 or interval < 1:
+        raise ValueError("frames and interval must be at least 1")
+    for i in range(warmup):
+        profile.step(dt)
+
+    filters = (tracemalloc.Filter(True, os.path.join(ROOT, '*')),
+               tracemalloc.Filter(False, __file__))
+    # one frame of traceback is enough to name a site, and much cheaper
+    tracemalloc.start(1)
+    first = tracemalloc.take_snapshot().filter_traces(filters)
+    samples = []
+    total = 0
+    worst = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        profile.step(dt)
+        used = tracemalloc.get_traced_memory()[1] - before
+        total += used
+        if used > worst:
+            worst = used
+        if frame % interval == 0 or frame == frames - 1:
+            last = tracemalloc.take_snapshot().filter_traces(filters)
+            samples.append((frame, sum(t.size for t in last.traces)))
+            print('frame', frame, 'held:', samples[-1][1], 'bytes,',
+                  'peak', total / (frame + 1), 'bytes/frame')
+    elapsed = time.perf_counter() - start
+    peak, sites = peakSites(profile, filters, breakdown, dt, top)
+    tracemalloc.stop()
+
+    return {
+        'frames': frames,
+        'seconds': elapsed,
+        'peak per frame': total / frames,
+        'worst peak': worst,
+        # ignore the first half of the samples; caches fill up early on
+        'growth per frame': growthPerFrame(samples[len(samples) // 2:]),
+        # sites whose held memory grew over the run
+        'top sites': last.compare_to(first, 'lineno')[:top],
+        # sites holding memory at the peak of the worst breakdown frame
+        'frame peak': peak,
+        'frame sites': sites
+    }
+
+def run(name='minecraft', frames=1000000, interval=100000, budget=4096,
+        growth=0.01):
+    """ Soak profile name against the stand-in backends -> True if the run
+            stayed within budget (peak bytes per frame, on average) and
+            growth (bytes retained per frame)
+    """
+    profile = mapper.Profile(name, mapper.readProfiles(),
+                             mapper.readControllers())
+    source = profile.controller.source
+    user32 = robot.user32
+    profile.controller.source = ScriptedSource(
+        scriptStates(exclude=abortButtons(profile)))
+    robot.user32 = NullUser32(user32)
+    try:
+        report = soak(profile, frames, interval)
+    finally:
+        profile.releaseAll()
+        profile.controller.source = source
+        robot.user32 = user32
+        profile.close()
+
+    print('Did', report['frames'], 'frames in', report['seconds'], 'seconds.')
+    print('Frames peaked', report['peak per frame'], 'bytes above where they',
+          'started on average,', report['worst peak'], 'in the worst frame.')
+    print('Held memory grew', report['growth per frame'], 'bytes per frame.')
+    print('Top growing allocation sites:')
+    for stat in report['top sites']:
+        print('\t', stat)
+    print('Sites holding memory at the peak of the worst sampled frame',
+          '(' + str(report['frame peak']), 'bytes):')
+    for stat in report['frame sites']:
+        print('\t', stat)
+
+    ok = True
+    if report['peak per frame'] > budget:
+        print('FAIL: over the budget of', budget, 'peak bytes per frame.')
+        ok = False
+    if report['growth per frame'] > growth:
+        print('FAIL: growing faster than', growth, 'bytes per frame.')
+        ok = False
+    return ok
+
+def positive(s):
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Soak a profile against stand-in backends and track '
+                    'its allocations.')
+    parser.add_argument('profile', nargs='?', default='minecraft')
+    parser.add_argument('--frames', type=positive, default=1000000)
+    parser.add_argument('--interval', type=positive, default=100000,
+                        help='frames between memory samples')
+    parser.add_argument('--budget', type=float, default=4096,
+                        help='allowed peak bytes per frame, on average')
+    parser.add_argument('--growth', type=float, default=0.01,
+                        help='allowed bytes retained per frame')
+    args = parser.parse_args()
+    ok = run(args.profile, args.frames, args.interval, args.budget,
+             args.growth)
+    sys.exit(0 if ok else 1)
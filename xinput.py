@@ -1,15 +1,19 @@
 import ctypes
 from ctypes import wintypes
-import os
 import time
 
+from bitmask import bitmask_iter, bitmask_pack
+import monitor
+
 xinput = ctypes.WinDLL('xinput1_3', use_last_error=True)
 
 def poll(id):
     state = XINPUT_STATE()
     ctypes.memset(ctypes.addressof(state), 0, ctypes.sizeof(state))
     xinput.XInputGetState(id, ctypes.byref(state))
-    return xinput_dict(state.gamepad)
+    r = xinput_dict(state.gamepad)
+    r['packet_number'] = state.packet_number
+    return r
 
 def xinput_dict(struct):
     r = dict((i[0], getattr(struct, i[0])) for i in struct._fields_)
@@ -57,14 +61,6 @@ xinput.XInputSetState.errcheck = _check_success
 xinput.XInputSetState.args = (wintypes.DWORD,
                               ctypes.POINTER(XINPUT_VIBRATION))
 
-def bitmask_iter(mask, length):
-    """ turn mask into list of the bits, least significant bit at index 0 """
-    i = length
-    while i:
-        yield mask & 0x01
-        mask >>= 1
-        i -= 1
-
 def controllerTest():
     state = XINPUT_STATE()
     ctypes.memset(ctypes.addressof(state), 0, ctypes.sizeof(state))
@@ -91,18 +87,28 @@ def controllerTest():
     print('Triggers', gamepad.left_trigger, gamepad.right_trigger)
 
 def controllerDebug():
-    while True:
-        state = XINPUT_STATE()
-        ctypes.memset(ctypes.addressof(state), 0, ctypes.sizeof(state))
-        xinput.XInputGetState(0, ctypes.byref(state))
-        gamepad = state.gamepad
-        print("Hit Ctrl-C to exit.")
-        print('Buttons:', list(bitmask_iter(gamepad.buttons, 16)))
-        print('Right Stick:', (gamepad.r_thumb_x, gamepad.r_thumb_y))
-        print('Left Stick:', (gamepad.l_thumb_x, gamepad.l_thumb_y))
-        print('Triggers', gamepad.left_trigger, gamepad.right_trigger)
-        time.sleep(1)
-        os.system('CLS')
+    """ Show the raw state of controller 0. To watch a running mapper
+            instead, use monitor.py.
+    """
+    screen = monitor.Screen()
+    state = XINPUT_STATE()
+    try:
+        while True:
+            ctypes.memset(ctypes.addressof(state), 0, ctypes.sizeof(state))
+            xinput.XInputGetState(0, ctypes.byref(state))
+            gamepad = state.gamepad
+            screen.draw([
+                "Hit Ctrl-C to exit.",
+                'Buttons: ' + str(list(bitmask_iter(gamepad.buttons, 16))),
+                'Right Stick: ' + str((gamepad.r_thumb_x, gamepad.r_thumb_y)),
+                'Left Stick: ' + str((gamepad.l_thumb_x, gamepad.l_thumb_y)),
+                'Triggers ' + str(gamepad.left_trigger) + ' '
+                    + str(gamepad.right_trigger)
+            ])
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        pass
+    screen.close()
         
 if __name__ == "__main__":
     controllerDebug()
\ No newline at end of file